@@ -6,20 +6,90 @@ WARNING: This gives TOTAL cost only, not per-service breakdown
 Cost Explorer version is recommended even with $0.01/call cost
 """
 
+import io
 import json
 import boto3
+import numpy as np
 import os
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Dict, List, Optional
 
-cloudwatch = boto3.client('cloudwatch', region_name='us-east-1')  # Billing metrics only in us-east-1
-sns = boto3.client('sns')
-s3 = boto3.client('s3')
+try:
+    import orjson  # Optional: ship it in the deployment package or a layer for faster serialization
+except ImportError:
+    orjson = None
 
-SNS_TOPIC_ARN = os.environ.get('SNS_TOPIC_ARN')
-S3_BUCKET = os.environ.get('S3_BUCKET')
-LOOKBACK_DAYS = int(os.environ.get('LOOKBACK_DAYS', '30'))
-ANOMALY_THRESHOLD = float(os.environ.get('ANOMALY_THRESHOLD', '3.0'))
+# Shared by all clients so warm containers keep their pooled (keep-alive) connections
+BOTO_CONFIG = Config(max_pool_connections=4, retries={'max_attempts': 2, 'mode': 'standard'}, tcp_keepalive=True)
+
+cloudwatch = boto3.client('cloudwatch', region_name='us-east-1', config=BOTO_CONFIG)  # Billing metrics only in us-east-1
+sns = boto3.client('sns', config=BOTO_CONFIG)
+s3 = boto3.client('s3', config=BOTO_CONFIG)
+
+
+@dataclass(frozen=True, slots=True)
+class MonitorConfig:
+    """Settings read from the environment once per container"""
+    sns_topic_arn: Optional[str]
+    s3_bucket: Optional[str]
+    lookback_days: int
+    anomaly_threshold: float
+    pretty_reports: bool  # Indent S3 reports for reading
+
+
+CONFIG = MonitorConfig(
+    sns_topic_arn=os.environ.get('SNS_TOPIC_ARN'),
+    s3_bucket=os.environ.get('S3_BUCKET'),
+    lookback_days=int(os.environ.get('LOOKBACK_DAYS', '30')),
+    anomaly_threshold=float(os.environ.get('ANOMALY_THRESHOLD', '3.0')),
+    pretty_reports=os.environ.get('PRETTY_REPORTS', 'false').lower() == 'true'
+)
+
+# Compact JSON (no whitespace after ',' and ':') for everything we serialize
+JSON_SEPARATORS = (',', ':')
+
+S3_TRANSFER_CONFIG = TransferConfig(multipart_chunksize=8 * 1024 * 1024, use_threads=True, max_concurrency=4)
+
+
+class ReusableBuffer(io.BytesIO):
+    """BytesIO that survives upload_fileobj, which closes the file object it is given"""
+    
+    def close(self):
+        pass
+
+
+# Reused across warm invocations by the stdlib json path so each report doesn't allocate a fresh buffer
+REPORT_BUFFER = ReusableBuffer()
+
+# MAD needs at least a week of daily costs to give a meaningful baseline
+MIN_LOOKBACK_DAYS = 7
+
+# Windows whose daily costs vary by less than this (cents) are treated as flat
+MIN_COST_RANGE_CENTS = 50
+
+# Alert text is built once at import; only the per-anomaly fields are filled in per call
+ALERT_SUBJECT_TEMPLATE = "🚨 AWS Cost Anomaly - {severity}"
+ALERT_MESSAGE_TEMPLATE = """
+AWS Cost Anomaly Alert (FREE CloudWatch Version)
+""" + '=' * 60 + """
+
+📅 Date: {date}
+💰 Daily Cost: ${cost:,.2f}
+📊 Expected (Median): ${median:,.2f}
+📈 Deviation: ${deviation_amount:,.2f} ({deviation_percent:+.1f}%)
+⚡ Z-Score: {z_score:.2f}
+🔔 Type: {anomaly_type}
+
+⚠️  NOTE: This is the FREE version using CloudWatch Billing Metrics
+    For service-level breakdown, use the Cost Explorer version ($0.01/run)
+
+Total Anomalies Detected: {total_anomalies}
+Detection Time: {detection_time}
+"""
 
 
 def lambda_handler(event, context):
@@ -27,27 +97,37 @@ def lambda_handler(event, context):
     FREE alternative using CloudWatch Billing Metrics
     NOTE: Requires billing metrics to be enabled in AWS Console
     """
+    # Misconfigured window: fail before paying for any CloudWatch request
+    if CONFIG.lookback_days < MIN_LOOKBACK_DAYS:
+        return create_response(400, f"LOOKBACK_DAYS must be >= {MIN_LOOKBACK_DAYS} for MAD")
+    
     try:
-        print(f"Starting FREE cost monitoring at {datetime.utcnow()}")
+        # Format the run time once and share it with everything that records it
+        now = datetime.utcnow()
+        now_iso = now.isoformat()
+        now_tag = now.strftime('%Y-%m-%d_%H-%M-%S')
+        
+        print(f"Starting FREE cost monitoring at {now_iso}")
         
         # Fetch billing data from CloudWatch (FREE)
-        cost_data = fetch_billing_metrics(LOOKBACK_DAYS)
+        cost_data = fetch_billing_metrics(CONFIG.lookback_days, now)
         
         if not cost_data:
             return create_response(200, "No billing data available. Enable detailed billing in AWS Console.")
         
         # Detect anomalies
-        anomalies = detect_anomalies_mad(cost_data, ANOMALY_THRESHOLD)
-        
-        # Save results
-        save_to_s3(cost_data, anomalies)
+        anomalies = detect_anomalies_mad(cost_data, CONFIG.anomaly_threshold)
         
-        # Send alerts if needed
-        if anomalies:
-            send_alert(anomalies)
+        # Save results and send alerts if needed; both are network-bound, so overlap them
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            saved = executor.submit(save_to_s3, cost_data, anomalies, now_iso, now_tag)
+            alerted = executor.submit(send_alert, anomalies, now_iso) if anomalies else None
+            saved.result()
+            if alerted:
+                alerted.result()
         
         result = {
-            'timestamp': datetime.utcnow().isoformat(),
+            'timestamp': now_iso,
             'total_days_analyzed': len(cost_data),
             'anomalies_detected': len(anomalies),
             'note': 'Using FREE CloudWatch Billing Metrics (total cost only)'
@@ -61,49 +141,58 @@ def lambda_handler(event, context):
         return create_response(500, f"Error: {str(e)}")
 
 
-def fetch_billing_metrics(lookback_days: int) -> List[Dict]:
+def fetch_billing_metrics(lookback_days: int, end_time: datetime) -> List[Dict]:
     """
     Fetch billing metrics from CloudWatch (100% FREE)
     
     IMPORTANT: Enable in AWS Console:
     Billing → Billing Preferences → Receive Billing Alerts (checkbox)
     """
-    end_time = datetime.utcnow()
-    start_time = end_time - timedelta(days=lookback_days)
+    # One extra day up front: the first day has no previous maximum to difference against
+    start_time = end_time - timedelta(days=lookback_days + 1)
     
     print(f"Fetching FREE billing metrics from {start_time} to {end_time}")
     
+    # Billing metrics only refresh every ~6 hours, so reuse the last fetch within the same window.
+    # Bump the version prefix whenever the cached payload changes shape or meaning.
+    cache_key = f"billing-cache/v3/{end_time:%Y%m%d}-{end_time.hour // 6}-{lookback_days}d.json"
+    
     try:
-        response = cloudwatch.get_metric_statistics(
-            Namespace='AWS/Billing',
-            MetricName='EstimatedCharges',
-            Dimensions=[
-                {'Name': 'Currency', 'Value': 'USD'}
-            ],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=86400,  # 1 day
-            Statistics=['Maximum']
-        )
+        datapoints = load_cached_datapoints(cache_key)
+        
+        if datapoints is None:
+            # GetMetricStatistics stays within the CloudWatch free tier (GetMetricData does not)
+            response = cloudwatch.get_metric_statistics(
+                Namespace='AWS/Billing',
+                MetricName='EstimatedCharges',
+                Dimensions=[
+                    {'Name': 'Currency', 'Value': 'USD'}
+                ],
+                StartTime=start_time,
+                EndTime=end_time,
+                Period=86400,  # 1 day
+                Statistics=['Maximum']
+            )
+            datapoints = response['Datapoints']
+            if datapoints:
+                cache_datapoints(cache_key, datapoints)
         
         # Sort by timestamp
-        datapoints = sorted(response['Datapoints'], key=lambda x: x['Timestamp'])
+        datapoints = sorted(datapoints, key=lambda x: x['Timestamp'])
+        
+        # Daily cost is the day-over-day change in the month-to-date maximum; clamp the
+        # negative step when the monthly charge resets and quantize to whole cents
+        maxes = np.fromiter((point['Maximum'] for point in datapoints), dtype=np.float64, count=len(datapoints))
+        daily_cents = np.rint(np.maximum(np.diff(maxes), 0) * 100).astype(np.int64).tolist()  # Ensure non-negative
         
         # Convert to our format
-        cost_data = []
-        for i, point in enumerate(datapoints):
-            # Calculate daily cost (difference from previous day)
-            if i > 0:
-                daily_cost = point['Maximum'] - datapoints[i-1]['Maximum']
-            else:
-                daily_cost = point['Maximum']  # First day is total
-            
-            cost_data.append({
-                'date': point['Timestamp'].strftime('%Y-%m-%d'),
-                'total_cost': round(max(daily_cost, 0), 2),  # Ensure non-negative
-                'cumulative_cost': round(point['Maximum'], 2),
-                'note': 'Total AWS cost only (no service breakdown in free version)'
-            })
+        cost_data = [
+            {
+                'date': point['Timestamp'].date().isoformat(),
+                'cost_cents': cost_cents
+            }
+            for point, cost_cents in zip(datapoints[1:], daily_cents)
+        ]
         
         print(f"Retrieved {len(cost_data)} days of FREE billing data")
         return cost_data
@@ -114,82 +203,135 @@ def fetch_billing_metrics(lookback_days: int) -> List[Dict]:
         raise
 
 
+def load_cached_datapoints(cache_key: str) -> Optional[List[Dict]]:
+    """Load billing datapoints cached by a previous run in the same refresh window"""
+    if not CONFIG.s3_bucket:
+        return None
+    
+    try:
+        response = s3.get_object(Bucket=CONFIG.s3_bucket, Key=cache_key)
+        datapoints = [
+            {'Timestamp': datetime.fromisoformat(point['Timestamp']), 'Maximum': float(point['Maximum'])}
+            for point in json.loads(response['Body'].read())
+        ]
+    except Exception as e:
+        # Missing, unreadable or wrongly shaped entries all fall back to a live fetch
+        print(f"Billing cache miss ({cache_key}): {str(e)}")
+        return None
+    
+    print(f"Using cached billing metrics from s3://{CONFIG.s3_bucket}/{cache_key}")
+    return datapoints
+
+
+def cache_datapoints(cache_key: str, datapoints: List[Dict]):
+    """Cache billing datapoints in S3 for the rest of the refresh window"""
+    if not CONFIG.s3_bucket:
+        return
+    
+    try:
+        s3.put_object(
+            Bucket=CONFIG.s3_bucket,
+            Key=cache_key,
+            Body=dumps_json(datapoints),
+            ContentType='application/json'
+        )
+    except Exception as e:
+        print(f"Error caching billing metrics: {str(e)}")
+
+
 def detect_anomalies_mad(cost_data: List[Dict], threshold: float) -> List[Dict]:
-    """Same MAD algorithm as paid version"""
-    if len(cost_data) < 7:
+    """Same MAD algorithm as paid version, on integer cents"""
+    if len(cost_data) < MIN_LOOKBACK_DAYS:
         return []
     
-    costs = [day['total_cost'] for day in cost_data]
+    costs = np.fromiter((day['cost_cents'] for day in cost_data), dtype=np.int64, count=len(cost_data))
     
-    # Calculate median
-    sorted_costs = sorted(costs)
-    n = len(sorted_costs)
-    median = sorted_costs[n // 2] if n % 2 == 1 else (sorted_costs[n // 2 - 1] + sorted_costs[n // 2]) / 2
+    # A flat window carries no signal; don't turn cent-level noise into alerts
+    if costs.max() - costs.min() < MIN_COST_RANGE_CENTS:
+        return []
     
-    # Calculate MAD
-    absolute_deviations = [abs(cost - median) for cost in costs]
-    sorted_deviations = sorted(absolute_deviations)
-    mad = sorted_deviations[n // 2] if n % 2 == 1 else (sorted_deviations[n // 2 - 1] + sorted_deviations[n // 2]) / 2
+    # Calculate median and MAD
+    median = partition_median(costs)
+    mad = partition_median(np.abs(costs - median))
     
-    if mad == 0:
-        mad = 0.01
+    # Modified z-scores for every day at once
+    if mad < 1e-9:
+        # Over half the days share one cost (e.g. idle $0 days), so MAD is degenerate;
+        # scale by the mean absolute deviation instead so real spikes still stand out
+        mean_ad = float(np.mean(np.abs(costs - median)))
+        z_scores = (costs - median) / (1.253314 * mean_ad)
+    else:
+        z_scores = 0.6745 * (costs - median) / mad
     
-    # Find anomalies
-    anomalies = []
-    for day in cost_data:
-        cost = day['total_cost']
-        modified_z_score = 0.6745 * (cost - median) / mad
-        
-        if abs(modified_z_score) > threshold:
-            anomaly_type = "spike" if modified_z_score > 0 else "drop"
-            severity = "critical" if abs(modified_z_score) > threshold * 1.5 else "warning"
-            
-            anomalies.append({
-                'date': day['date'],
-                'cost': cost,
-                'median': round(median, 2),
-                'z_score': round(modified_z_score, 2),
-                'anomaly_type': anomaly_type,
-                'severity': severity,
-                'deviation_amount': round(cost - median, 2),
-                'deviation_percent': round(((cost - median) / median * 100), 2) if median > 0 else 0,
-                'note': 'Use Cost Explorer version for service-level breakdown'
-            })
+    # Find anomalies, ranked by |z-score| (largest first)
+    abs_z = np.abs(z_scores)
+    idx = np.flatnonzero(abs_z > threshold)
+    order = idx[np.argsort(-abs_z[idx], kind='stable')]
+    
+    # Classify and measure all anomalies at once
+    ranked_z = z_scores[order]
+    median_cents = round(median)
+    deviations = costs[order] - median
+    deviation_cents = costs[order] - median_cents  # Consistent with the reported (rounded) median
+    deviation_percents = deviations / median * 100 if median > 0 else np.zeros_like(deviations)
+    anomaly_types = np.where(ranked_z > 0, 'spike', 'drop')
+    severities = np.where(np.abs(ranked_z) > threshold * 1.5, 'critical', 'warning')
+    
+    anomalies = [
+        {
+            'date': cost_data[i]['date'],
+            'cost_cents': cost_data[i]['cost_cents'],
+            'median_cents': median_cents,
+            'z_score': z_score,
+            'anomaly_type': anomaly_type,
+            'severity': severity,
+            'deviation_cents': deviation_cents,
+            'deviation_percent': deviation_percent,
+            'note': 'Use Cost Explorer version for service-level breakdown'
+        }
+        for i, z_score, anomaly_type, severity, deviation_cents, deviation_percent in zip(
+            order.tolist(),
+            ranked_z.round(2).tolist(),
+            anomaly_types.tolist(),
+            severities.tolist(),
+            deviation_cents.tolist(),
+            deviation_percents.round(2).tolist()
+        )
+    ]
     
-    anomalies.sort(key=lambda x: abs(x['z_score']), reverse=True)
     return anomalies
 
 
-def send_alert(anomalies: List[Dict]):
+def partition_median(values: np.ndarray) -> float:
+    """Median via introselect (O(n)) instead of a full sort"""
+    n = len(values)
+    k = n // 2
+    if n % 2 == 1:
+        return float(np.partition(values, k)[k])
+    partitioned = np.partition(values, [k - 1, k])
+    return float(0.5 * (partitioned[k - 1] + partitioned[k]))
+
+
+def send_alert(anomalies: List[Dict], detection_time: str):
     """Send SNS alert"""
-    if not SNS_TOPIC_ARN:
+    if not CONFIG.sns_topic_arn:
         return
     
     anomaly = anomalies[0]
     
-    subject = f"🚨 AWS Cost Anomaly - {anomaly['severity'].upper()}"
-    
-    message = f"""
-AWS Cost Anomaly Alert (FREE CloudWatch Version)
-{'=' * 60}
-
-📅 Date: {anomaly['date']}
-💰 Daily Cost: ${anomaly['cost']:,.2f}
-📊 Expected (Median): ${anomaly['median']:,.2f}
-📈 Deviation: ${anomaly['deviation_amount']:,.2f} ({anomaly['deviation_percent']:+.1f}%)
-⚡ Z-Score: {anomaly['z_score']:.2f}
-🔔 Type: {anomaly['anomaly_type'].upper()}
-
-⚠️  NOTE: This is the FREE version using CloudWatch Billing Metrics
-    For service-level breakdown, use the Cost Explorer version ($0.01/run)
-
-Total Anomalies Detected: {len(anomalies)}
-Detection Time: {datetime.utcnow().isoformat()}
-"""
+    subject = ALERT_SUBJECT_TEMPLATE.format(severity=anomaly['severity'].upper())
+    message = ALERT_MESSAGE_TEMPLATE.format_map(anomaly | {
+        'cost': anomaly['cost_cents'] / 100,
+        'median': anomaly['median_cents'] / 100,
+        'deviation_amount': anomaly['deviation_cents'] / 100,
+        'anomaly_type': anomaly['anomaly_type'].upper(),
+        'total_anomalies': len(anomalies),
+        'detection_time': detection_time
+    })
     
     try:
         sns.publish(
-            TopicArn=SNS_TOPIC_ARN,
+            TopicArn=CONFIG.sns_topic_arn,
             Subject=subject,
             Message=message
         )
@@ -198,30 +340,40 @@ Detection Time: {datetime.utcnow().isoformat()}
         print(f"Error sending alert: {str(e)}")
 
 
-def save_to_s3(cost_data: List[Dict], anomalies: List[Dict]):
+def save_to_s3(cost_data: List[Dict], anomalies: List[Dict], timestamp: str, report_tag: str):
     """Save to S3"""
-    if not S3_BUCKET:
+    if not CONFIG.s3_bucket:
         return
     
-    timestamp = datetime.utcnow().strftime('%Y-%m-%d_%H-%M-%S')
-    
     result = {
-        'timestamp': datetime.utcnow().isoformat(),
+        'timestamp': timestamp,
         'version': 'FREE - CloudWatch Billing Metrics',
         'cost_data': cost_data,
+        'cost_data_note': 'Total AWS cost only (no service breakdown in free version)',
         'anomalies': anomalies,
         'note': 'For service-level analysis, upgrade to Cost Explorer version'
     }
     
     try:
-        key = f"cost-anomaly-reports/{timestamp}.json"
-        s3.put_object(
-            Bucket=S3_BUCKET,
+        if orjson is not None:
+            # orjson hands back finished bytes; upload them as-is rather than copying into the pool
+            body = io.BytesIO(orjson.dumps(result, option=orjson.OPT_INDENT_2 if CONFIG.pretty_reports else 0))
+        else:
+            REPORT_BUFFER.seek(0)
+            REPORT_BUFFER.truncate()
+            write_json(REPORT_BUFFER, result, indent=CONFIG.pretty_reports)
+            REPORT_BUFFER.seek(0)
+            body = REPORT_BUFFER
+        
+        key = f"cost-anomaly-reports/{report_tag}.json"
+        s3.upload_fileobj(
+            Fileobj=body,
+            Bucket=CONFIG.s3_bucket,
             Key=key,
-            Body=json.dumps(result, indent=2),
-            ContentType='application/json'
+            Config=S3_TRANSFER_CONFIG,
+            ExtraArgs={'ContentType': 'application/json'}
         )
-        print(f"Results saved to s3://{S3_BUCKET}/{key}")
+        print(f"Results saved to s3://{CONFIG.s3_bucket}/{key}")
     except Exception as e:
         print(f"Error saving to S3: {str(e)}")
 
@@ -230,13 +382,30 @@ def create_response(status_code: int, message: str, data: Optional[Dict] = None)
     """Create response"""
     return {
         'statusCode': status_code,
-        'body': json.dumps({
+        'body': dumps_json({
             'message': message,
             'data': data
-        })
+        }).decode('utf-8')
     }
 
 
+def dumps_json(obj) -> bytes:
+    """Compact UTF-8 JSON, via orjson when available (datetimes become ISO strings)"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=JSON_SEPARATORS, default=datetime.isoformat).encode('utf-8')
+
+
+def write_json(buffer: io.BytesIO, obj, indent: bool = False):
+    """Stream obj as UTF-8 JSON into buffer with the stdlib encoder"""
+    writer = io.TextIOWrapper(buffer, encoding='utf-8', write_through=True)
+    if indent:
+        json.dump(obj, writer, indent=2, default=datetime.isoformat)
+    else:
+        json.dump(obj, writer, separators=JSON_SEPARATORS, default=datetime.isoformat)
+    writer.detach()  # Keep the caller's buffer open
+
+
 """
 SETUP INSTRUCTIONS FOR FREE VERSION:
 
@@ -253,6 +422,11 @@ SETUP INSTRUCTIONS FOR FREE VERSION:
 3. Run manually:
    - ./trigger.sh (100% FREE - no Cost Explorer API calls)
 
+4. Dependencies:
+   - numpy must be available to the function; the CloudFormation template
+     attaches the layer given in NumpyLayerArn (e.g. AWS SDK for pandas)
+   - orjson is optional; bundle it for faster JSON serialization
+
 LIMITATIONS:
 - Total cost only (no per-service breakdown)
 - Updated every 6 hours (not real-time)